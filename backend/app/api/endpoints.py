@@ -1,20 +1,25 @@
 from fastapi import APIRouter, UploadFile, File, HTTPException, Form, Body
 from fastapi.responses import FileResponse, RedirectResponse
-import shutil
 import os
+import glob
 import uuid
 from typing import Optional, List
 from pydantic import BaseModel
 import numpy as np
+import cv2
 from PIL import Image
-import io
 import hashlib
+import asyncio
+from cachetools import TTLCache
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from app.core.lut_generator import (
-    process_video_to_lut, 
-    process_image_to_lut, 
-    process_url_to_lut, 
+    analyze_video, 
+    get_lab_stats,
+    generate_lut_from_stats,
+    analyze_url, 
     search_movies,
-    process_movie_selection_to_lut
+    analyze_movie_selection
 )
 from app.core.storage import storage_manager
 
@@ -27,6 +32,17 @@ GENERATED_DIR = os.path.join(DATA_DIR, "generated")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(GENERATED_DIR, exist_ok=True)
 
+# Larger copy buffer means far fewer read/write syscalls for big video uploads
+UPLOAD_COPY_BUFFER_SIZE = 1024 * 1024
+
+# Worker processes for the GIL-bound part of LUT generation (transfer + .cube
+# formatting). Only the six target stats are sent across, never the image.
+# forkserver avoids forking a process that already has executor threads running.
+cpu_pool = ProcessPoolExecutor(
+    max_workers=int(os.getenv("LUT_PROCESS_WORKERS", str(os.cpu_count() or 1))),
+    mp_context=multiprocessing.get_context("forkserver"),
+)
+
 class UrlRequest(BaseModel):
     url: str
     timestamp: float = 0.0
@@ -38,7 +54,102 @@ class MovieSelectionRequest(BaseModel):
     url: str
 
 def generate_cache_key(prefix: str, data: str) -> str:
-    return hashlib.md5(f"{prefix}:{data}".encode()).hexdigest()
+    return hashlib.blake2b(f"{prefix}:{data}".encode(), digest_size=16).hexdigest()
+
+# --- Blocking helpers (run via asyncio.to_thread to keep the event loop free) ---
+
+def _save_upload(src, video_path: str) -> str:
+    """Copies the upload to disk, hashing it on the way through; returns the content digest."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(video_path, "wb") as buffer:
+        for chunk in iter(lambda: src.read(UPLOAD_COPY_BUFFER_SIZE), b''):
+            digest.update(chunk)
+            buffer.write(chunk)
+    return digest.hexdigest()
+
+def _dedupe_upload(video_path: str, existing_path: str) -> bool:
+    """
+    Replaces video_path with a hard link to an identical stored upload.
+    The link is made under a temp name and swapped in atomically, so the new
+    file stays in place if existing_path has vanished or linking fails.
+    """
+    tmp_path = f"{video_path}.link"
+    try:
+        os.link(existing_path, tmp_path)
+        os.replace(tmp_path, video_path)
+        return True
+    except OSError as e:
+        print(f"Upload dedup failed, keeping separate copy: {e}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return False
+
+def _hash_upload(src) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    src.seek(0)
+    for chunk in iter(lambda: src.read(UPLOAD_COPY_BUFFER_SIZE), b''):
+        digest.update(chunk)
+    src.seek(0)
+    return digest.hexdigest()
+
+def _read_upload_array(src) -> np.ndarray:
+    """Reads an upload's spooled file straight into a uint8 array, without an intermediate bytes copy."""
+    src.seek(0, os.SEEK_END)
+    data = np.empty(src.tell(), dtype=np.uint8)
+    src.seek(0)
+    return data[:src.readinto(data)]
+
+def _analyze_uploaded_image(src, frame_path: str):
+    """Decodes an uploaded image, writes its preview and returns its target LAB (mean, std)."""
+    # OpenCV decodes straight into an ndarray; Pillow is only needed for formats it can't read
+    bgr = cv2.imdecode(_read_upload_array(src), cv2.IMREAD_COLOR)
+    if bgr is not None:
+        cv2.imwrite(frame_path, bgr, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        image_np = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+    else:
+        src.seek(0)
+        image = Image.open(src)
+        
+        if image.mode in ('RGBA', 'P'): 
+            image = image.convert('RGB')
+        image.save(frame_path)
+        
+        image_np = np.array(image)
+    # cv2/NumPy release the GIL here, so the stats are cheap to keep on the thread
+    return get_lab_stats(image_np)
+
+async def _generate_lut_in_pool(target_mean, target_std, lut_path: str):
+    """Runs the GIL-bound colour transfer and .cube formatting in cpu_pool."""
+    await asyncio.get_running_loop().run_in_executor(
+        cpu_pool, generate_lut_from_stats, target_mean, target_std, lut_path
+    )
+
+async def _upload_results(lut_path: str, lut_filename: str, frame_path: str, frame_filename: str):
+    """Uploads the LUT and preview frame to Supabase concurrently; returns (lut_url, frame_url)."""
+    return await asyncio.gather(
+        storage_manager.upload_file(lut_path, f"generated/{lut_filename}"),
+        storage_manager.upload_file(frame_path, f"generated/{frame_filename}"),
+    )
+
+# Uploads that never reach /generate-lut would otherwise stay in these maps for
+# the life of the process. Losing an entry is harmless: _find_upload falls back
+# to globbing and dedup simply stores a fresh copy.
+UPLOAD_MAP_MAXSIZE = 4096
+UPLOAD_MAP_TTL_SECONDS = 24 * 3600
+# file_id -> (uploaded video filename, content digest), so lookups don't scan UPLOAD_DIR
+_uploads: TTLCache = TTLCache(maxsize=UPLOAD_MAP_MAXSIZE, ttl=UPLOAD_MAP_TTL_SECONDS)
+# content digest -> path of a stored upload with those bytes
+_upload_digests: TTLCache = TTLCache(maxsize=UPLOAD_MAP_MAXSIZE, ttl=UPLOAD_MAP_TTL_SECONDS)
+
+def _find_upload(file_id: str) -> Optional[str]:
+    entry = _uploads.get(file_id)
+    if entry:
+        return os.path.join(UPLOAD_DIR, entry[0])
+    # Files uploaded before a restart aren't in the map
+    matches = glob.glob(os.path.join(UPLOAD_DIR, f"{glob.escape(file_id)}.*"))
+    return matches[0] if matches else None
 
 @router.post("/upload")
 async def upload_video(file: UploadFile = File(...)):
@@ -48,8 +159,17 @@ async def upload_video(file: UploadFile = File(...)):
     
     # Save locally first (for processing)
     video_path = os.path.join(UPLOAD_DIR, video_filename)
-    with open(video_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    digest = await asyncio.to_thread(_save_upload, file.file, video_path)
+    _uploads[file_id] = (video_filename, digest)
+
+    # Identical re-uploads share one copy on disk; each keeps its own file_id.
+    # Regenerating a LUT from the same frame then hits the stats-keyed LUT cache.
+    existing_path = _upload_digests.get(digest)
+    if existing_path and existing_path != video_path and os.path.exists(existing_path):
+        await asyncio.to_thread(_dedupe_upload, video_path, existing_path)
+    else:
+        # Also replaces a digest whose file has since been deleted
+        _upload_digests[digest] = video_path
     
     # OPTIMIZATION: Skip uploading the raw video to Supabase.
     # We only need it locally to extract the frame. 
@@ -59,13 +179,8 @@ async def upload_video(file: UploadFile = File(...)):
 
 @router.post("/generate-lut/{file_id}")
 async def generate_lut(file_id: str, timestamp: float = Body(None, embed=True)):
-    video_path = None
-    for f in os.listdir(UPLOAD_DIR):
-        if f.startswith(file_id):
-            video_path = os.path.join(UPLOAD_DIR, f)
-            break
-            
-    if not video_path:
+    video_path = _find_upload(file_id)
+    if not video_path or not os.path.exists(video_path):
         raise HTTPException(status_code=404, detail="Video not found (might have expired)")
         
     lut_filename = f"{file_id}.cube"
@@ -74,19 +189,22 @@ async def generate_lut(file_id: str, timestamp: float = Body(None, embed=True)):
     frame_path = os.path.join(GENERATED_DIR, frame_filename)
     
     try:
-        process_video_to_lut(video_path, lut_path, frame_path, timestamp)
+        target_mean, target_std = await asyncio.to_thread(analyze_video, video_path, frame_path, timestamp)
+        await _generate_lut_in_pool(target_mean, target_std, lut_path)
         
         # Upload ONLY results to Supabase
         lut_url = f"/api/download/generated/{lut_filename}"
         frame_url = f"/api/download/generated/{frame_filename}"
 
         if storage_manager.is_enabled():
-            l_url = await storage_manager.upload_file(lut_path, f"generated/{lut_filename}", cleanup_after=True)
-            f_url = await storage_manager.upload_file(frame_path, f"generated/{frame_filename}", cleanup_after=False)
+            l_url, f_url = await _upload_results(lut_path, lut_filename, frame_path, frame_filename)
             if l_url: lut_url = l_url
             if f_url: frame_url = f_url
             
         # Clean up local video file to save space
+        entry = _uploads.pop(file_id, None)
+        if entry and _upload_digests.get(entry[1]) == video_path:
+            _upload_digests.pop(entry[1], None)
         try:
             if os.path.exists(video_path):
                 os.remove(video_path)
@@ -103,6 +221,17 @@ async def generate_lut(file_id: str, timestamp: float = Body(None, embed=True)):
 
 @router.post("/generate-from-image")
 async def generate_from_image(file: UploadFile = File(...)):
+    # Check cache (keyed by the image bytes, so re-submitted frames skip processing)
+    cache_key = None
+    if storage_manager.is_enabled():
+        cache_key = generate_cache_key("image", await asyncio.to_thread(_hash_upload, file.file))
+        cached = await storage_manager.get_cached_analysis(cache_key)
+        if cached:
+            return {
+                "lut_url": cached['lut_path'],
+                "frame_url": cached['frame_path']
+            }
+
     file_id = str(uuid.uuid4())
     lut_filename = f"{file_id}.cube"
     frame_filename = f"{file_id}.jpg"
@@ -110,25 +239,21 @@ async def generate_from_image(file: UploadFile = File(...)):
     frame_path = os.path.join(GENERATED_DIR, frame_filename)
     
     try:
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
-        
-        if image.mode in ('RGBA', 'P'): 
-            image = image.convert('RGB')
-        image.save(frame_path)
-        
-        image_np = np.array(image)
-        process_image_to_lut(image_np, lut_path)
+        target_mean, target_std = await asyncio.to_thread(_analyze_uploaded_image, file.file, frame_path)
+        await _generate_lut_in_pool(target_mean, target_std, lut_path)
         
         # Upload to Supabase
         lut_url = f"/api/download/generated/{lut_filename}"
         frame_url = f"/api/download/generated/{frame_filename}"
 
         if storage_manager.is_enabled():
-            l_url = await storage_manager.upload_file(lut_path, f"generated/{lut_filename}", cleanup_after=True)
-            f_url = await storage_manager.upload_file(frame_path, f"generated/{frame_filename}", cleanup_after=False)
+            l_url, f_url = await _upload_results(lut_path, lut_filename, frame_path, frame_filename)
             if l_url: lut_url = l_url
             if f_url: frame_url = f_url
+            
+            # Save to cache
+            if l_url and f_url:
+                await storage_manager.save_cached_analysis(cache_key, lut_url, frame_url)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -156,14 +281,14 @@ async def generate_from_url(request: UrlRequest):
     frame_path = os.path.join(GENERATED_DIR, frame_filename)
     
     try:
-        process_url_to_lut(request.url, request.timestamp, lut_path, frame_path)
+        target_mean, target_std = await asyncio.to_thread(analyze_url, request.url, request.timestamp, frame_path)
+        await _generate_lut_in_pool(target_mean, target_std, lut_path)
         
         lut_url = f"/api/download/generated/{lut_filename}"
         frame_url = f"/api/download/generated/{frame_filename}"
 
         if storage_manager.is_enabled():
-            l_url = await storage_manager.upload_file(lut_path, f"generated/{lut_filename}", cleanup_after=True)
-            f_url = await storage_manager.upload_file(frame_path, f"generated/{frame_filename}", cleanup_after=False)
+            l_url, f_url = await _upload_results(lut_path, lut_filename, frame_path, frame_filename)
             if l_url: lut_url = l_url
             if f_url: frame_url = f_url
             
@@ -181,7 +306,7 @@ async def generate_from_url(request: UrlRequest):
 @router.post("/search-movie")
 async def search_movie_endpoint(request: MovieSearchRequest):
     try:
-        results = search_movies(request.query)
+        results = await asyncio.to_thread(search_movies, request.query)
         return {"results": results}
     except Exception as e:
         print(f"Movie search error: {e}")
@@ -205,14 +330,14 @@ async def analyze_movie_selection(request: MovieSelectionRequest):
     frame_path = os.path.join(GENERATED_DIR, frame_filename)
     
     try:
-        process_movie_selection_to_lut(request.url, lut_path, frame_path)
+        target_mean, target_std = await asyncio.to_thread(analyze_movie_selection, request.url, frame_path)
+        await _generate_lut_in_pool(target_mean, target_std, lut_path)
         
         lut_url = f"/api/download/generated/{lut_filename}"
         frame_url = f"/api/download/generated/{frame_filename}"
 
         if storage_manager.is_enabled():
-            l_url = await storage_manager.upload_file(lut_path, f"generated/{lut_filename}", cleanup_after=True)
-            f_url = await storage_manager.upload_file(frame_path, f"generated/{frame_filename}", cleanup_after=False)
+            l_url, f_url = await _upload_results(lut_path, lut_filename, frame_path, frame_filename)
             if l_url: lut_url = l_url
             if f_url: frame_url = f_url
             
@@ -1,12 +1,21 @@
 import numpy as np
 import cv2
-from PIL import Image
 import ffmpeg
 import yt_dlp
 import os
-import io
 import random
 import logging
+import hashlib
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import TTLCache, cached
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; the NumPy path is used without it
+    njit = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -48,6 +57,32 @@ def get_ydl_opts(base_opts=None):
         opts.update(base_opts)
     return opts
 
+# yt-dlp lookups take seconds; signed stream URLs expire, so only hold them briefly
+YTDLP_CACHE_TTL_SECONDS = 600
+
+ANDROID_USER_AGENT = 'com.google.android.youtube/17.36.4 (Linux; U; Android 12; GB) gzip'
+
+_ydl_local = threading.local()
+
+def get_ydl(profile: str, base_opts: dict, android: bool = False) -> yt_dlp.YoutubeDL:
+    """
+    Returns this thread's long-lived YoutubeDL for an option profile.
+    Reusing the instance keeps its HTTP connections and cookie jar warm between
+    calls; instances are per thread because YoutubeDL isn't thread-safe.
+    """
+    instances = getattr(_ydl_local, 'instances', None)
+    if instances is None:
+        instances = _ydl_local.instances = {}
+    key = (profile, android)
+    ydl = instances.get(key)
+    if ydl is None:
+        opts = get_ydl_opts(base_opts)
+        if android:
+            opts['extractor_args']['youtube']['player_client'] = ['android']
+            opts['http_headers']['User-Agent'] = ANDROID_USER_AGENT
+        ydl = instances[key] = yt_dlp.YoutubeDL(opts)
+    return ydl
+
 def is_frame_useful(frame_np):
     """
     Determines if a frame is good for color analysis.
@@ -74,82 +109,92 @@ def is_frame_useful(frame_np):
         
     return True
 
+@cached(cache=TTLCache(maxsize=128, ttl=YTDLP_CACHE_TTL_SECONDS), lock=threading.RLock())
 def search_movies(query: str) -> list[dict]:
     """
     Searches YouTube for the query and returns a list of results.
     """
     search_query = f"{query} official trailer 4k"
-    ydl_opts = get_ydl_opts({
+    ydl_opts = {
         'format': 'best[ext=mp4]/best',
         'default_search': 'ytsearch5:',
         'extract_flat': True,
-    })
+    }
 
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(search_query, download=False)
-            results = []
-            if 'entries' in info:
-                for entry in info['entries']:
-                    if not entry: continue
-                    results.append({
-                        'title': entry.get('title', 'Unknown Title'),
-                        'url': entry.get('url', ''),
-                        'thumbnail': entry.get('thumbnail', None),
-                        'duration': entry.get('duration', 0),
-                        'view_count': entry.get('view_count', 0)
-                    })
-            
-            if not results and 'url' in info:
-                 results.append({
-                    'title': info.get('title', 'Unknown Title'),
-                    'url': info.get('url', ''),
-                    'thumbnail': info.get('thumbnail', None),
-                     'duration': info.get('duration', 0),
-                    'view_count': info.get('view_count', 0)
+        info = get_ydl('search', ydl_opts).extract_info(search_query, download=False)
+        results = []
+        if 'entries' in info:
+            for entry in info['entries']:
+                if not entry: continue
+                results.append({
+                    'title': entry.get('title', 'Unknown Title'),
+                    'url': entry.get('url', ''),
+                    'thumbnail': entry.get('thumbnail', None),
+                    'duration': entry.get('duration', 0),
+                    'view_count': entry.get('view_count', 0)
                 })
-            
-            if not results:
-                raise ValueError("No video results found")
-            return results
+        
+        if not results and 'url' in info:
+             results.append({
+                'title': info.get('title', 'Unknown Title'),
+                'url': info.get('url', ''),
+                'thumbnail': info.get('thumbnail', None),
+                 'duration': info.get('duration', 0),
+                'view_count': info.get('view_count', 0)
+            })
+        
+        if not results:
+            raise ValueError("No video results found")
+        return results
 
     except Exception as e:
         logger.warning(f"iOS search failed: {e}. Retrying with Android...")
-        ydl_opts['extractor_args']['youtube']['player_client'] = ['android']
-        ydl_opts['http_headers']['User-Agent'] = 'com.google.android.youtube/17.36.4 (Linux; U; Android 12; GB) gzip'
         
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(search_query, download=False)
-                results = []
-                if 'entries' in info:
-                    for entry in info['entries']:
-                        if entry:
-                            results.append({
-                                'title': entry.get('title', 'Unknown Title'),
-                                'url': entry.get('url', ''),
-                                'thumbnail': entry.get('thumbnail', None),
-                                'duration': entry.get('duration', 0),
-                                'view_count': entry.get('view_count', 0)
-                            })
-                return results
+            info = get_ydl('search', ydl_opts, android=True).extract_info(search_query, download=False)
+            results = []
+            if 'entries' in info:
+                for entry in info['entries']:
+                    if entry:
+                        results.append({
+                            'title': entry.get('title', 'Unknown Title'),
+                            'url': entry.get('url', ''),
+                            'thumbnail': entry.get('thumbnail', None),
+                            'duration': entry.get('duration', 0),
+                            'view_count': entry.get('view_count', 0)
+                        })
+            return results
         except Exception as e2:
             raise RuntimeError(f"Search failed: {str(e2)}")
 
 def extract_frame_from_video(video_path: str, timestamp: float = None) -> np.ndarray:
-    cap = cv2.VideoCapture(video_path)
+    # Opt into hardware decoding where available; OpenCV falls back to software
+    cap = cv2.VideoCapture(
+        video_path, cv2.CAP_FFMPEG,
+        [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY]
+    )
+    if not cap.isOpened():
+        cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
         raise ValueError("Could not open video file")
 
-    if timestamp is None:
-        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        target_frame = frame_count // 2
-        cap.set(cv2.CAP_PROP_POS_FRAMES, target_frame)
-    else:
-        cap.set(cv2.CAP_PROP_POS_MSEC, timestamp * 1000)
-    
-    ret, frame = cap.read()
-    cap.release()
+    try:
+        if timestamp is None:
+            # Seek to the middle by time: POS_FRAMES can force decoding every
+            # frame from the start, while POS_MSEC lets ffmpeg jump to a keyframe.
+            frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            if fps > 0:
+                cap.set(cv2.CAP_PROP_POS_MSEC, (frame_count / fps) * 1000 / 2)
+            else:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, frame_count // 2)
+        else:
+            cap.set(cv2.CAP_PROP_POS_MSEC, timestamp * 1000)
+        
+        ret, frame = cap.read()
+    finally:
+        cap.release()
 
     if not ret:
         raise ValueError("Could not read frame from video")
@@ -157,83 +202,128 @@ def extract_frame_from_video(video_path: str, timestamp: float = None) -> np.nda
     frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
     return frame_rgb
 
+@cached(cache=TTLCache(maxsize=128, ttl=YTDLP_CACHE_TTL_SECONDS), lock=threading.RLock())
+def resolve_video_url(url: str) -> tuple[str, float]:
+    """
+    Resolves a page URL to a direct stream URL and duration via yt-dlp.
+    Results are memoized per URL for a short TTL.
+    """
+    ydl_opts = {'format': 'best[ext=mp4]/best'}
+    try:
+        info = get_ydl('resolve', ydl_opts).extract_info(url, download=False)
+    except Exception:
+        try:
+            info = get_ydl('resolve', ydl_opts, android=True).extract_info(url, download=False)
+        except Exception as e2:
+            raise RuntimeError(f"Failed to extract video URL: {str(e2)}")
+
+    return info['url'], info.get('duration') or 60
+
 def extract_frame_from_url(url: str, timestamp: float = 0) -> np.ndarray:
     if "youtube.com" in url or "youtu.be" in url or "vimeo.com" in url:
-        ydl_opts = get_ydl_opts({'format': 'best[ext=mp4]/best'})
-        try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                video_url = info['url']
-        except Exception:
-            ydl_opts['extractor_args']['youtube']['player_client'] = ['android']
-            ydl_opts['http_headers']['User-Agent'] = 'com.google.android.youtube/17.36.4 (Linux; U; Android 12; GB) gzip'
-            try:
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info = ydl.extract_info(url, download=False)
-                    video_url = info['url']
-            except Exception as e2:
-                raise RuntimeError(f"Failed to extract video URL: {str(e2)}")
+        video_url, _ = resolve_video_url(url)
     else:
         video_url = url
         
     try:
+        width, height = probe_frame_size(video_url)
         out, _ = (
             ffmpeg
             .input(video_url, ss=timestamp)
-            .output('pipe:', vframes=1, format='image2', vcodec='png')
+            .output('pipe:', vframes=1, format='rawvideo', pix_fmt='rgb24')
             .run(capture_stdout=True, capture_stderr=True)
         )
-        image = Image.open(io.BytesIO(out))
-        return np.array(image)
+        return np.frombuffer(out, np.uint8).reshape(height, width, 3)
     except ffmpeg.Error as e:
         raise RuntimeError(f"ffmpeg error: {e.stderr.decode('utf8')}")
     except Exception as e:
         raise RuntimeError(f"Frame extraction failed: {str(e)}")
 
+@cached(cache=TTLCache(maxsize=128, ttl=YTDLP_CACHE_TTL_SECONDS), lock=threading.RLock())
+def probe_frame_size(video_url: str) -> tuple[int, int]:
+    """Returns (width, height) of the first video stream, memoized per URL."""
+    try:
+        probe = ffmpeg.probe(video_url, select_streams='v:0')
+    except ffmpeg.Error as e:
+        raise RuntimeError(f"ffprobe error: {e.stderr.decode('utf8')}")
+    stream = probe['streams'][0]
+    return int(stream['width']), int(stream['height'])
+
+def extract_frames_from_url(video_url: str, timestamps: list[float]) -> list[np.ndarray]:
+    """
+    Extracts one frame per timestamp from a direct video URL with a single ffmpeg process.
+    Each timestamp is an input-side seek; the first frame of each is concatenated
+    and piped back as raw rgb24, so no image codec sits between ffmpeg and NumPy.
+    """
+    width, height = probe_frame_size(video_url)
+    streams = [
+        ffmpeg.input(video_url, ss=ts).video.trim(end_frame=1).setpts('PTS-STARTPTS')
+        for ts in timestamps
+    ]
+    try:
+        out, _ = (
+            ffmpeg
+            .concat(*streams, v=1, a=0)
+            # passthrough: every segment is a single frame rebased to PTS 0, so
+            # vfr would treat them as duplicates and drop all but the first.
+            .output('pipe:', format='rawvideo', pix_fmt='rgb24', vsync='passthrough')
+            .run(capture_stdout=True, capture_stderr=True)
+        )
+    except ffmpeg.Error as e:
+        raise RuntimeError(f"ffmpeg error: {e.stderr.decode('utf8')}")
+
+    frame_bytes = height * width * 3
+    if len(out) % frame_bytes or len(out) // frame_bytes != len(timestamps):
+        raise RuntimeError(
+            f"Expected {len(timestamps)} frames from ffmpeg, got {len(out) / frame_bytes:g}"
+        )
+    return list(np.frombuffer(out, np.uint8).reshape(len(timestamps), height, width, 3))
+
+MAX_FRAME_WORKERS = 10  # Cap concurrent ffmpeg reads against the same CDN
+
 def extract_multiple_frames_from_url(url: str, target_samples: int = 5) -> list[np.ndarray]:
     """
     Extracts frames, filters out bad ones (dark/blurry), and returns the best target_samples.
     """
-    ydl_opts = get_ydl_opts({'format': 'best[ext=mp4]/best'})
-    
-    try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            video_url = info['url']
-            duration = info.get('duration', 60)
-    except Exception:
-        ydl_opts['extractor_args']['youtube']['player_client'] = ['android']
-        ydl_opts['http_headers']['User-Agent'] = 'com.google.android.youtube/17.36.4 (Linux; U; Android 12; GB) gzip'
-        try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                video_url = info['url']
-                duration = info.get('duration', 60)
-        except Exception as e2:
-             raise RuntimeError(f"Failed to extract video URL: {str(e2)}")
+    video_url, duration = resolve_video_url(url)
 
     valid_frames = []
-    attempts = 0
     max_attempts = target_samples * 4 # Try 4x as many timestamps as needed
     
     if duration < 5: duration = 5
     
     # Generate more timestamps than needed to allow for filtering
     timestamps = sorted([random.uniform(duration * 0.1, duration * 0.9) for _ in range(max_attempts)])
-    
-    for ts in timestamps:
+
+    def try_extract(ts):
         try:
-            frame = extract_frame_from_url(video_url, ts)
-            if is_frame_useful(frame):
-                valid_frames.append(frame)
-                logger.info(f"✅ Accepted frame at {ts}s")
-            else:
-                logger.info(f"❌ Rejected frame at {ts}s (dark/blurry)")
-                
-            if len(valid_frames) >= target_samples:
-                break
+            return extract_frame_from_url(video_url, ts)
         except Exception as e:
             logger.warning(f"Failed to extract frame at {ts}: {e}")
+            return None
+
+    # Fetch timestamps in batches, one ffmpeg process per batch, stopping as soon
+    # as enough useful frames have been collected. If a batched call fails (e.g.
+    # one seek lands past the end), fall back to concurrent per-frame extraction.
+    batch_size = min(target_samples, MAX_FRAME_WORKERS)
+    with ThreadPoolExecutor(max_workers=batch_size) as ex:
+        for start in range(0, len(timestamps), batch_size):
+            batch = timestamps[start:start + batch_size]
+            try:
+                frames = extract_frames_from_url(video_url, batch)
+            except Exception as e:
+                logger.warning(f"Batched frame extraction failed, retrying per frame: {e}")
+                frames = ex.map(try_extract, batch)
+            for ts, frame in zip(batch, frames):
+                if frame is None:
+                    continue
+                if is_frame_useful(frame):
+                    valid_frames.append(frame)
+                    logger.info(f"✅ Accepted frame at {ts}s")
+                else:
+                    logger.info(f"❌ Rejected frame at {ts}s (dark/blurry)")
+            if len(valid_frames) >= target_samples:
+                break
 
     if not valid_frames:
         # If strict filtering rejected everything, try relaxed filtering or just take whatever we got
@@ -242,99 +332,252 @@ def extract_multiple_frames_from_url(url: str, target_samples: int = 5) -> list[
     return valid_frames[:target_samples]
 
 # --- Color Science Functions ---
-def get_lab_stats(image_np):
+# LAB mean/std barely move under area-averaged downsampling, so large frames
+# are shrunk before conversion to keep the working set cache-sized.
+STATS_MAX_DIM = 512
+STATS_SAMPLE_SIZE = (256, 256)
+
+def _prepare_for_stats(image_np):
     if image_np.shape[2] == 4: image_np = cv2.cvtColor(image_np, cv2.COLOR_RGBA2RGB)
-    img_lab = cv2.cvtColor(image_np.astype(np.uint8), cv2.COLOR_RGB2LAB).astype(np.float32)
+    if max(image_np.shape[:2]) > STATS_MAX_DIM:
+        image_np = cv2.resize(image_np, STATS_SAMPLE_SIZE, interpolation=cv2.INTER_AREA)
+    return image_np.astype(np.uint8)
+
+def get_lab_stats(image_np):
+    img_lab = cv2.cvtColor(_prepare_for_stats(image_np), cv2.COLOR_RGB2LAB).astype(np.float32)
     mean = np.mean(img_lab, axis=(0, 1))
     std = np.std(img_lab, axis=(0, 1))
     return mean, std
 
 def get_aggregated_lab_stats(frames: list[np.ndarray]):
-    means, stds = [], []
-    for frame in frames:
-        m, s = get_lab_stats(frame)
-        means.append(m)
-        stds.append(s)
-    avg_mean = np.mean(means, axis=0)
-    avg_std = np.mean(stds, axis=0)
-    return avg_mean, avg_std
+    # Pool every frame's pixels into one (N, 1, 3) column so there is a single
+    # LAB conversion, and the std is the true pooled std rather than a mean of
+    # per-frame stds. Flattening first means frames may differ in size.
+    pixels = np.concatenate([_prepare_for_stats(f).reshape(-1, 1, 3) for f in frames], axis=0)
+    lab = cv2.cvtColor(pixels, cv2.COLOR_RGB2LAB).astype(np.float32).reshape(-1, 3)
+    return lab.mean(axis=0), lab.std(axis=0)
 
 def generate_identity_lut(size=33):
-    x = np.linspace(0, 255, size)
-    y = np.linspace(0, 255, size)
-    z = np.linspace(0, 255, size)
-    B, G, R = np.meshgrid(z, y, x, indexing='ij')
-    lut = np.stack([R, G, B], axis=-1)
-    return lut.astype(np.float32)
-
-def apply_color_transfer(identity_lut, target_mean, target_std):
+    # Indexed [b, g, r]; fill each channel by broadcasting instead of meshgrid + stack
+    v = np.linspace(0, 255, size, dtype=np.float32)
+    lut = np.empty((size, size, size, 3), dtype=np.float32)
+    lut[..., 0] = v[None, None, :]
+    lut[..., 1] = v[None, :, None]
+    lut[..., 2] = v[:, None, None]
+    return lut
+
+def _lut_to_lab(lut):
+    h, w, d, c = lut.shape
+    lut_image = lut.reshape(h * w, d, 3).astype(np.uint8)
+    return cv2.cvtColor(lut_image, cv2.COLOR_RGB2LAB).astype(np.float32).reshape(-1, 3)
+
+LUT_SIZE = 33
+
+# The identity LUT and its LAB stats (the colour-transfer source) are the same
+# for every request, so build them once at import time.
+_IDENTITY_LUT = generate_identity_lut(LUT_SIZE)
+_IDENTITY_LAB = _lut_to_lab(_IDENTITY_LUT)
+_SRC_MEAN = _IDENTITY_LAB.mean(axis=0)
+_SRC_STD = _IDENTITY_LAB.std(axis=0)
+
+def _transform_lab_numpy(lab_flat, src_mean, src_std, tgt_mean, tgt_std, out):
+    # In-place ufuncs so the chain allocates no full-size temporaries
+    np.subtract(lab_flat, src_mean, out=out)
+    out *= tgt_std / (src_std + 1e-6)
+    out += tgt_mean
+
+def _transfer_to_rgb_numpy(lab_flat, src_mean, src_std, tgt_mean, tgt_std, out):
+    result_lab = np.empty_like(out)
+    _transform_lab_numpy(lab_flat, src_mean, src_std, tgt_mean, tgt_std, result_lab)
+    out[:] = cv2.cvtColor(result_lab.reshape(-1, 1, 3), cv2.COLOR_LAB2RGB).reshape(-1, 3)
+    np.clip(out, 0, 255, out=out)
+
+if njit is not None:
+    # XYZ -> linear sRGB (D65), columns pre-scaled by the D65 white point,
+    # mirroring OpenCV's float COLOR_LAB2RGB.
+    _LAB2RGB_COEFFS = (np.array([
+        [3.240479, -1.53715, -0.498535],
+        [-0.969256, 1.875991, 0.041556],
+        [0.055648, -0.204043, 1.057311],
+    ]) * np.array([0.950456, 1.0, 1.088754])).astype(np.float32)
+
+    # Deliberately serial: this runs from several executor threads at once and
+    # numba's default workqueue threading layer aborts on concurrent parallel
+    # calls. At 33^3 voxels the kernel takes ~2 ms, so threads buy little.
+    @njit(fastmath=True, cache=True)
+    def _transfer_to_rgb(lab_flat, src_mean, src_std, tgt_mean, tgt_std, out):
+        # Fused affine LAB transform + LAB->sRGB per voxel, so no intermediate
+        # LAB buffer is materialized between the two stages.
+        m = _LAB2RGB_COEFFS
+        l_thresh = 0.008856 * 903.3
+        f_thresh = 7.787 * 0.008856 + 16.0 / 116.0
+        for i in range(lab_flat.shape[0]):
+            li = (lab_flat[i, 0] - src_mean[0]) * tgt_std[0] / (src_std[0] + 1e-6) + tgt_mean[0]
+            ai = (lab_flat[i, 1] - src_mean[1]) * tgt_std[1] / (src_std[1] + 1e-6) + tgt_mean[1]
+            bi = (lab_flat[i, 2] - src_mean[2]) * tgt_std[2] / (src_std[2] + 1e-6) + tgt_mean[2]
+
+            if li <= l_thresh:
+                y = li / 903.3
+                fy = 7.787 * y + 16.0 / 116.0
+            else:
+                fy = (li + 16.0) / 116.0
+                y = fy * fy * fy
+            fx = ai / 500.0 + fy
+            fz = fy - bi / 200.0
+            x = (fx - 16.0 / 116.0) / 7.787 if fx <= f_thresh else fx * fx * fx
+            z = (fz - 16.0 / 116.0) / 7.787 if fz <= f_thresh else fz * fz * fz
+
+            for c in range(3):
+                v = m[c, 0] * x + m[c, 1] * y + m[c, 2] * z
+                v = min(max(v, 0.0), 1.0)
+                out[i, c] = v * 12.92 if v <= 0.0031308 else 1.055 * v ** (1.0 / 2.4) - 0.055
+else:
+    _transfer_to_rgb = _transfer_to_rgb_numpy
+
+def apply_color_transfer(target_mean, target_std, identity_lut=None):
+    if identity_lut is None:
+        identity_lut, lut_lab = _IDENTITY_LUT, _IDENTITY_LAB
+        src_mean, src_std = _SRC_MEAN, _SRC_STD
+    else:
+        # Identity LUT stats (Source), per LAB channel
+        lut_lab = _lut_to_lab(identity_lut)
+        src_mean = lut_lab.mean(axis=0)
+        src_std = lut_lab.std(axis=0)
     h, w, d, c = identity_lut.shape
-    lut_flat = identity_lut.reshape(-1, 3)
-    lut_image = lut_flat.reshape(h * w, d, 3).astype(np.uint8)
-    lut_lab = cv2.cvtColor(lut_image, cv2.COLOR_RGB2LAB).astype(np.float32)
-    l, a, b = cv2.split(lut_lab)
-    
-    # Identity LUT stats (Source)
-    l_mean, l_std = np.mean(l), np.std(l)
-    a_mean, a_std = np.mean(a), np.std(a)
-    b_mean, b_std = np.mean(b), np.std(b)
-    
-    src_means = [l_mean, a_mean, b_mean]
-    src_stds = [l_std, a_std, b_std]
-    channels = [l, a, b]
-    res_channels = []
-    
-    for i in range(3):
-        ch = channels[i]
-        ch = ch - src_means[i]
-        scale = target_std[i] / (src_stds[i] + 1e-6)
-        ch = ch * scale
-        ch = ch + target_mean[i]
-        res_channels.append(ch)
-        
-    result_lab = cv2.merge(res_channels)
-    result_rgb = cv2.cvtColor(result_lab.astype(np.float32), cv2.COLOR_LAB2RGB)
-    result_rgb = np.clip(result_rgb, 0, 255)
+
+    result_rgb = np.empty(lut_lab.shape, dtype=np.float32)
+    _transfer_to_rgb(
+        lut_lab, src_mean.astype(np.float32), src_std.astype(np.float32),
+        np.asarray(target_mean, dtype=np.float32), np.asarray(target_std, dtype=np.float32),
+        result_rgb,
+    )
     return result_rgb.reshape(h, w, d, 3)
 
 def write_cube_file(lut_rgb, file_path, size=33):
-    with open(file_path, 'w') as f:
-        f.write(f'TITLE "Generated by Color Stealer"\n')
-        f.write(f'LUT_3D_SIZE {size}\n')
-        for z in range(size):
-            for y in range(size):
-                for x in range(size):
-                    r, g, b = lut_rgb[z, y, x]
-                    f.write(f'{r/255.0:.6f} {g/255.0:.6f} {b/255.0:.6f}\n')
+    # lut_rgb is indexed [z, y, x] (blue, green, red), so its C-order
+    # flattening already matches the .cube convention of red varying fastest.
+    arr = (lut_rgb.reshape(-1, 3) / 255.0).astype(np.float32)
+    # Format the whole file in memory with one prebuilt format string (np.savetxt
+    # still loops over rows in Python), then hand it to the kernel in one write.
+    body = ('%.6f %.6f %.6f\n' * len(arr)) % tuple(arr.ravel().tolist())
+    data = memoryview(f'TITLE "Generated by Color Stealer"\nLUT_3D_SIZE {size}\n{body}'.encode())
+    fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        while data:
+            data = data[os.write(fd, data):]
+    finally:
+        os.close(fd)
+
+# --- LUT Result Cache ---
+
+LUT_CACHE_DIR = os.path.join(os.getenv("DATA_DIR", "data"), "generated", "_cache")
+LUT_CACHE_MAX_ENTRIES = int(os.getenv("LUT_CACHE_MAX_ENTRIES", "256"))
+# The cache persists across deploys (DATA_DIR is a volume), so bump this whenever
+# apply_color_transfer or write_cube_file change the bytes produced for given stats.
+LUT_CACHE_VERSION = 2
+
+def _lut_cache_path(target_mean, target_std, size):
+    # Keyed on the six LAB stats rather than the image: hashing a full-resolution
+    # frame costs about as much as regenerating the LUT.
+    h = hashlib.blake2b(f"v{LUT_CACHE_VERSION}:{size}".encode(), digest_size=16)
+    h.update(np.asarray(target_mean, dtype=np.float32).tobytes())
+    h.update(np.asarray(target_std, dtype=np.float32).tobytes())
+    return os.path.join(LUT_CACHE_DIR, f"{h.hexdigest()}.cube")
+
+def _evict_lut_cache():
+    """Drops the least recently used entries once the cache grows past its bound."""
+    entries = [e for e in os.scandir(LUT_CACHE_DIR) if e.name.endswith('.cube')]
+    if len(entries) <= LUT_CACHE_MAX_ENTRIES:
+        return
+    entries.sort(key=lambda e: e.stat().st_mtime)
+    for entry in entries[:len(entries) - LUT_CACHE_MAX_ENTRIES]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+def _store_in_lut_cache(lut_path, cache_path):
+    os.makedirs(LUT_CACHE_DIR, exist_ok=True)
+    # A unique temp file per store: threads in one process share a PID, so a
+    # PID-based name would let concurrent stores of one key clobber each other.
+    fd, tmp_path = tempfile.mkstemp(dir=LUT_CACHE_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as dst, open(lut_path, 'rb') as src:
+            shutil.copyfileobj(src, dst)
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    _evict_lut_cache()
 
 # --- Processing Pipelines ---
 
+def _write_preview(frame_rgb, path):
+    code = cv2.COLOR_RGBA2BGR if frame_rgb.shape[2] == 4 else cv2.COLOR_RGB2BGR
+    cv2.imwrite(path, cv2.cvtColor(frame_rgb, code), [cv2.IMWRITE_JPEG_QUALITY, 85])
+
+def generate_lut_from_stats(target_mean, target_std, output_lut_path):
+    """Writes the .cube for the given target LAB stats, reusing a cached copy when present."""
+    cache_path = _lut_cache_path(target_mean, target_std, LUT_SIZE)
+    if os.path.exists(cache_path):
+        try:
+            shutil.copyfile(cache_path, output_lut_path)
+            os.utime(cache_path)  # Mark as recently used
+            return
+        except OSError as e:
+            logger.warning(f"LUT cache read failed, regenerating: {e}")
+
+    transformed_lut = apply_color_transfer(target_mean, target_std)
+    write_cube_file(transformed_lut, output_lut_path, LUT_SIZE)
+
+    try:
+        _store_in_lut_cache(output_lut_path, cache_path)
+    except OSError as e:
+        logger.warning(f"LUT cache write failed: {e}")
+
 def process_image_to_lut(image_np, output_lut_path):
     target_mean, target_std = get_lab_stats(image_np)
-    identity = generate_identity_lut(33)
-    transformed_lut = apply_color_transfer(identity, target_mean, target_std)
-    write_cube_file(transformed_lut, output_lut_path, 33)
+    generate_lut_from_stats(target_mean, target_std, output_lut_path)
 
-def process_video_to_lut(video_path, output_lut_path, output_frame_path=None, timestamp=None):
+# The analyze_* steps do the frame extraction, preview and stats, which are
+# mostly I/O and GIL-releasing OpenCV work. They return the target LAB stats so
+# callers can run generate_lut_from_stats elsewhere, e.g. in a process pool.
+
+def analyze_video(video_path, output_frame_path=None, timestamp=None):
     frame = extract_frame_from_video(video_path, timestamp)
     if output_frame_path:
-        Image.fromarray(frame).save(output_frame_path)
-    process_image_to_lut(frame, output_lut_path)
+        _write_preview(frame, output_frame_path)
+    return get_lab_stats(frame)
 
-def process_url_to_lut(url, timestamp, output_lut_path, output_frame_path=None):
+def analyze_url(url, timestamp, output_frame_path=None):
     frame = extract_frame_from_url(url, timestamp)
     if output_frame_path:
-        Image.fromarray(frame).save(output_frame_path)
-    process_image_to_lut(frame, output_lut_path)
+        _write_preview(frame, output_frame_path)
+    return get_lab_stats(frame)
 
-def process_movie_selection_to_lut(video_url, output_lut_path, output_frame_path):
+def analyze_movie_selection(video_url, output_frame_path):
     """
-    Processes a specific selected movie trailer URL.
+    Samples a specific selected movie trailer URL and returns its pooled LAB stats.
     """
     frames = extract_multiple_frames_from_url(video_url, target_samples=5)
-    avg_mean, avg_std = get_aggregated_lab_stats(frames)
-    identity = generate_identity_lut(33)
-    transformed_lut = apply_color_transfer(identity, avg_mean, avg_std)
-    write_cube_file(transformed_lut, output_lut_path, 33)
     # Save first frame as preview
-    Image.fromarray(frames[0]).save(output_frame_path)
+    _write_preview(frames[0], output_frame_path)
+    return get_aggregated_lab_stats(frames)
+
+def process_video_to_lut(video_path, output_lut_path, output_frame_path=None, timestamp=None):
+    target_mean, target_std = analyze_video(video_path, output_frame_path, timestamp)
+    generate_lut_from_stats(target_mean, target_std, output_lut_path)
+
+def process_url_to_lut(url, timestamp, output_lut_path, output_frame_path=None):
+    target_mean, target_std = analyze_url(url, timestamp, output_frame_path)
+    generate_lut_from_stats(target_mean, target_std, output_lut_path)
+
+def process_movie_selection_to_lut(video_url, output_lut_path, output_frame_path):
+    """
+    Processes a specific selected movie trailer URL.
+    """
+    avg_mean, avg_std = analyze_movie_selection(video_url, output_frame_path)
+    generate_lut_from_stats(avg_mean, avg_std, output_lut_path)
@@ -3,13 +3,28 @@ from supabase import create_client, Client
 from typing import Optional, List
 import asyncio
 from functools import wraps
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import hashlib
 
 class StorageManager:
+    # Must match the interval in the "Allow anon delete of expired rows" policy
+    # (supabase_schema.sql)
+    MIN_FILE_AGE = timedelta(hours=24)
+    
     def __init__(self):
         self.supabase: Optional[Client] = None
         self.bucket_name = os.getenv("SUPABASE_BUCKET", "color-stealer")
+        # Bound concurrent uploads so bursts don't exhaust Supabase's connection limit
+        self._upload_sem = asyncio.Semaphore(int(os.getenv("SUPABASE_MAX_CONCURRENT_UPLOADS", "10")))
+        # Generated files are only popular for a short while after creation
+        self.max_file_age = timedelta(hours=float(os.getenv("SUPABASE_MAX_FILE_AGE_HOURS", "24")))
+        if self.max_file_age < self.MIN_FILE_AGE:
+            # RLS only lets the anon key delete analysis_cache rows older than
+            # MIN_FILE_AGE; expiring files sooner would leave rows pointing at them
+            min_hours = self.MIN_FILE_AGE / timedelta(hours=1)
+            print(f"⚠️  SUPABASE_MAX_FILE_AGE_HOURS is below {min_hours:g}; using {min_hours:g}")
+            self.max_file_age = self.MIN_FILE_AGE
+        self.cleanup_interval = int(os.getenv("SUPABASE_CLEANUP_INTERVAL_SECONDS", "600"))
         
         # Initialize Supabase if credentials are present
         supabase_url = os.getenv("SUPABASE_URL")
@@ -52,50 +67,80 @@ class StorageManager:
     
     async def cleanup_old_files(self):
         """
-        Delete all files from Supabase to stay within 1GB free limit.
+        Delete files older than max_file_age to stay within 1GB free limit,
+        along with the analysis_cache rows that point at them.
         """
         if not self.supabase:
             return
             
+        cutoff = datetime.now(timezone.utc) - self.max_file_age
         try:
-            # List all files in the bucket
-            files = self.supabase.storage.from_(self.bucket_name).list()
-            file_names = [f['name'] for f in files if f['name'] not in ['.', '..']]
+            bucket = self.supabase.storage.from_(self.bucket_name)
+            expired = []
+            for folder in ("", "generated"):
+                expired.extend(await self._list_expired(bucket, folder, cutoff))
+            
+            for i in range(0, len(expired), self.LIST_PAGE_SIZE):
+                await asyncio.to_thread(bucket.remove, expired[i:i + self.LIST_PAGE_SIZE])
+            if expired:
+                print(f"Deleted {len(expired)} expired files from Supabase bucket '{self.bucket_name}'.")
             
-            if file_names:
-                # Delete all listed files
-                self.supabase.storage.from_(self.bucket_name).remove(file_names)
-                print(f"Deleted {len(file_names)} files from Supabase bucket '{self.bucket_name}'.")
-            else:
-                print(f"No files to delete in Supabase bucket '{self.bucket_name}'.")
+            # Cached URLs for deleted objects would now 404, so expire them too
+            query = self.supabase.table('analysis_cache').delete().lt('created_at', cutoff.isoformat())
+            await asyncio.to_thread(query.execute)
         except Exception as e:
             print(f"Error deleting files from Supabase bucket: {e}")
     
-    async def upload_file(self, local_path: str, remote_path: str, cleanup_after: bool = True) -> Optional[str]:
+    LIST_PAGE_SIZE = 1000
+    
+    async def _list_expired(self, bucket, folder: str, cutoff: datetime) -> List[str]:
+        """
+        Pages through a folder oldest-first and returns paths created before cutoff.
+        storage3 lists only 100 objects sorted by name by default, which would hide
+        older files once the first page is all recent.
+        """
+        expired = []
+        offset = 0
+        while True:
+            options = {
+                'limit': self.LIST_PAGE_SIZE,
+                'offset': offset,
+                'sortBy': {'column': 'created_at', 'order': 'asc'},
+            }
+            files = await asyncio.to_thread(bucket.list, folder, options)
+            for f in files:
+                # Folders come back without an id or timestamps
+                if not f.get('id') or not f.get('created_at'):
+                    continue
+                if datetime.fromisoformat(f['created_at'].replace('Z', '+00:00')) >= cutoff:
+                    return expired  # Oldest-first, so everything after is newer too
+                expired.append(f"{folder}/{f['name']}" if folder else f['name'])
+            if len(files) < self.LIST_PAGE_SIZE:
+                return expired
+            offset += self.LIST_PAGE_SIZE
+    
+    async def run_periodic_cleanup(self):
+        """Runs cleanup_old_files forever; started as a background task at app startup."""
+        while self.supabase:
+            await self.cleanup_old_files()
+            await asyncio.sleep(self.cleanup_interval)
+    
+    async def upload_file(self, local_path: str, remote_path: str, cleanup_after: bool = False) -> Optional[str]:
         """
         Upload a file to Supabase Storage.
-        If cleanup_after=True, deletes old files to free space (for 1GB free plan).
+        If cleanup_after=True, deletes expired files first. Cleanup normally runs
+        from run_periodic_cleanup instead, keeping it off the upload path.
         """
         if not self.supabase:
             return None
             
         try:
-            # Cleanup old files BEFORE uploading to ensure space
-            # NOTE: For caching to work persistently, we should be careful about deleting files.
-            # But strictly adhering to 1GB limit request, we clean up. 
-            # Ideally, we'd only delete if near quota.
             if cleanup_after:
                 await self.cleanup_old_files()
             
-            with open(local_path, 'rb') as f:
-                file_data = f.read()
-                
-            # Upload to Supabase
-            self.supabase.storage.from_(self.bucket_name).upload(
-                remote_path,
-                file_data,
-                file_options={"content-type": self._get_content_type(local_path), "upsert": "true"}
-            )
+            async with self._upload_sem:
+                # supabase-py is synchronous; run it off the event loop
+                await asyncio.to_thread(self._upload_sync, local_path, remote_path)
             
             return self.get_public_url(remote_path)
             
@@ -103,6 +148,16 @@ class StorageManager:
             print(f"Upload error for {remote_path}: {e}")
             return None
     
+    def _upload_sync(self, local_path: str, remote_path: str):
+        # Hand supabase-py the open file rather than its bytes; httpx streams it
+        # from disk in chunks, so large previews never sit fully in memory.
+        with open(local_path, 'rb') as f:
+            self.supabase.storage.from_(self.bucket_name).upload(
+                remote_path,
+                f,
+                file_options={"content-type": self._get_content_type(local_path), "upsert": "true"}
+            )
+    
     def get_public_url(self, remote_path: str) -> Optional[str]:
         """Get the public URL for a file in Supabase Storage."""
         if not self.supabase:
@@ -133,7 +188,8 @@ class StorageManager:
     async def get_cached_analysis(self, cache_key: str):
         if not self.supabase: return None
         try:
-            response = self.supabase.table('analysis_cache').select('*').eq('cache_key', cache_key).execute()
+            query = self.supabase.table('analysis_cache').select('*').eq('cache_key', cache_key)
+            response = await asyncio.to_thread(query.execute)
             if response.data:
                 return response.data[0]
         except Exception as e:
@@ -149,7 +205,7 @@ class StorageManager:
                 'lut_path': lut_url, # Storing full URL for simplicity now
                 'frame_path': frame_url
             }
-            self.supabase.table('analysis_cache').insert(data).execute()
+            await asyncio.to_thread(self.supabase.table('analysis_cache').insert(data).execute)
         except Exception as e:
             print(f"Cache save error: {e}")
 
@@ -1,12 +1,28 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.api.endpoints import router
+from app.api.endpoints import router, cpu_pool
+from app.core.storage import storage_manager
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-app = FastAPI(title="Video Color Grade Stealer")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Blocking endpoint work (ffmpeg, OpenCV, disk I/O) runs via asyncio.to_thread,
+    # which uses the loop's default executor, so size it explicitly.
+    max_workers = int(os.getenv("WORKER_THREADS", "16"))
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=max_workers))
+    cleanup_task = asyncio.create_task(storage_manager.run_periodic_cleanup())
+    yield
+    cleanup_task.cancel()
+    cpu_pool.shutdown(cancel_futures=True)
+
+app = FastAPI(title="Video Color Grade Stealer", lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -17,3 +17,9 @@ create policy "Allow public read access" on analysis_cache for select using (tru
 -- For simplicity in this MVP, we'll allow anon to insert if they have the key
 create policy "Allow anon insert" on analysis_cache for insert with check (true);
 
+-- Allow the backend's periodic cleanup to expire stale cache rows. Scoped to
+-- rows past the cleanup age so the public anon key can't wipe live cache
+-- entries. StorageManager.MIN_FILE_AGE mirrors this interval and keeps
+-- SUPABASE_MAX_FILE_AGE_HOURS from going below it; change both together.
+create policy "Allow anon delete of expired rows" on analysis_cache for delete
+  using (created_at < now() - interval '24 hours');